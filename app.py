@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import io
 from datetime import datetime, timedelta
 
@@ -26,6 +27,124 @@ from utils import (
     create_date_filter
 )
 
+# Serialize Plotly figures with orjson instead of the pure-Python JSON encoder
+pio.json.config.default_engine = 'orjson'
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _compute_tab1_stats(_df, data_key, today, start_date, end_date, min_loan, max_loan):
+    """
+    Compute the delinquency statistics shown in the Delinquency Trends tab.
+    
+    Results are cached on the loaded data, the metrics date and the filter values, so the
+    filtered frame itself (passed as _df) is never hashed.
+    
+    Args:
+        _df: Filtered DataFrame with delinquency metrics
+        data_key: Identifier of the loaded data files
+        today: Date the delinquency metrics were computed against
+        start_date, end_date, min_loan, max_loan: Active filter values
+    
+    Returns:
+        Tuple of (late_counts, avg_late_by_loan) DataFrames
+    """
+    # Distribution of days late
+    # Categorize days late in a single vectorized pass
+    days_late_category = pd.cut(
+        _df['days_late'],
+        bins=[-np.inf, -1, 0, 7, 14, 30, 60, np.inf],
+        labels=['Early', 'On time', '1-7 days', '8-14 days',
+                '15-30 days', '31-60 days', '60+ days']
+    ).rename('days_late_category')
+    
+    # Group by the category and count
+    late_counts = _df.groupby(days_late_category, observed=True).size().reset_index(name='count')
+    
+    # Average days late by loan amount
+    # Create loan amount ranges manually
+    # Find min and max loan amounts for range creation
+    min_issued, max_issued = _df['issued_sum'].agg(['min', 'max'])
+    
+    # Create range bins (5 equal bins)
+    bin_size = (max_issued - min_issued) / 5
+    bins = [min_issued + i * bin_size for i in range(6)]
+    
+    # Create labels for the bins
+    labels = [f'${bins[i]:.0f}-${bins[i+1]:.0f}' for i in range(5)]
+    
+    # Assign each loan to a bin with a binary search over the inner edges
+    # (the maximum value falls into the last bin)
+    bin_codes = np.searchsorted(bins[1:-1], _df['issued_sum'].to_numpy(), side='right')
+    loan_amount_range = pd.Series(np.asarray(labels)[bin_codes], index=_df.index, name='loan_amount_range')
+    
+    # Group by the loan amount range and calculate average days late
+    avg_late_by_loan = _df['days_late'].groupby(loan_amount_range).mean().reset_index()
+    
+    return late_counts, avg_late_by_loan
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _compute_tab2_stats(_df, data_key, today, start_date, end_date, min_loan, max_loan):
+    """
+    Compute the payment gap statistics shown in the Planned vs Actual Payments tab.
+    
+    Args:
+        _df: Filtered DataFrame with delinquency metrics
+        data_key: Identifier of the loaded data files
+        today: Date the delinquency metrics were computed against
+        start_date, end_date, min_loan, max_loan: Active filter values
+    
+    Returns:
+        Tuple of (gap_counts, gap_edges, sample_df)
+    """
+    # Payment gap distribution
+    gap_percentage = _df['payment_gap_pct'].to_numpy()
+    
+    # Bin the gaps here so only the bar heights are sent to the browser
+    # (plans with a zero amount give infinite percentages and are skipped)
+    gap_counts, gap_edges = np.histogram(
+        gap_percentage[np.isfinite(gap_percentage)],
+        bins=50
+    )
+    
+    # Cumulative payments over time (only the columns the chart needs)
+    payment_time_df = _df[['order_id', 'plan_at', 'paid_at', 'plan_sum_total', 'paid_sum']].sort_values('plan_at')
+    
+    # Take a sample of orders for clarity
+    sample_orders = payment_time_df['order_id'].unique()[:5]
+    sample_df = payment_time_df[payment_time_df['order_id'].isin(sample_orders)]
+    
+    # Running totals are only needed for the sampled orders; the cached sample
+    # keeps only its own order_id categories instead of every loaded order
+    sample_groups = sample_df.groupby('order_id', observed=True, sort=False)
+    sample_df = sample_df.assign(
+        order_id=sample_df['order_id'].cat.remove_unused_categories(),
+        cumulative_planned=sample_groups['plan_sum_total'].cumsum(),
+        cumulative_actual=sample_groups['paid_sum'].cumsum()
+    )
+    
+    return gap_counts, gap_edges, sample_df
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _compute_tab3_stats(_df, data_key, today, start_date, end_date, min_loan, max_loan):
+    """
+    Compute the lateness aggregates shown in the Payment Behavior tab.
+    
+    Args:
+        _df: Filtered DataFrame with delinquency metrics
+        data_key: Identifier of the loaded data files
+        today: Date the delinquency metrics were computed against
+        start_date, end_date, min_loan, max_loan: Active filter values
+    
+    Returns:
+        Tuple of (avg_lateness_by_age, monthly_delinquency) DataFrames
+    """
+    # Payment lateness over loan duration
+    avg_lateness_by_age = _df.groupby('loan_age_months')['days_late'].mean().reset_index()
+    
+    # Seasonal patterns in payment behavior (month_name is ordered January to December)
+    monthly_delinquency = _df.groupby('month_name', observed=True)['days_late'].mean().reset_index()
+    
+    return avg_lateness_by_age, monthly_delinquency
+
 # Set page title and layout
 st.set_page_config(
     page_title="Credit Loan Payment Analysis Dashboard",
@@ -56,25 +175,30 @@ if 'merged_df' not in st.session_state:
     st.session_state.merged_df = None
 if 'delinquency_df' not in st.session_state:
     st.session_state.delinquency_df = None
+if 'data_key' not in st.session_state:
+    st.session_state.data_key = {}
 
 # Process uploaded files
 if orders_file is not None:
     try:
-        st.session_state.orders_df = process_orders_data(orders_file)
+        st.session_state.orders_df = process_orders_data(orders_file.getvalue())
+        st.session_state.data_key['orders'] = orders_file.file_id
         st.sidebar.success(f"Orders data loaded: {len(st.session_state.orders_df)} records")
     except Exception as e:
         st.sidebar.error(f"Error processing orders file: {e}")
 
 if plan_file is not None:
     try:
-        st.session_state.plan_df = process_plan_data(plan_file)
+        st.session_state.plan_df = process_plan_data(plan_file.getvalue())
+        st.session_state.data_key['plan'] = plan_file.file_id
         st.sidebar.success(f"Payment plan data loaded: {len(st.session_state.plan_df)} records")
     except Exception as e:
         st.sidebar.error(f"Error processing payment plan file: {e}")
 
 if payments_file is not None:
     try:
-        st.session_state.payments_df = process_payments_data(payments_file)
+        st.session_state.payments_df = process_payments_data(payments_file.getvalue())
+        st.session_state.data_key['payments'] = payments_file.file_id
         st.sidebar.success(f"Payments data loaded: {len(st.session_state.payments_df)} records")
     except Exception as e:
         st.sidebar.error(f"Error processing payments file: {e}")
@@ -91,7 +215,14 @@ if (st.session_state.orders_df is not None and
             st.session_state.payments_df
         )
         
-        st.session_state.delinquency_df = calculate_delinquency_metrics(st.session_state.merged_df)
+        # Lateness of unpaid installments is measured against today's date
+        today = pd.Timestamp.now().normalize()
+        st.session_state.delinquency_df = calculate_delinquency_metrics(st.session_state.merged_df, today)
+        
+        # Loan amount bounds for the slider (single pass over the column)
+        issued_bounds = st.session_state.merged_df['issued_sum'].agg(['min', 'max'])
+        st.session_state.issued_lo = float(issued_bounds['min'])
+        st.session_state.issued_hi = float(issued_bounds['max'])
         
         # Display filters in sidebar after data is loaded
         st.sidebar.header("Filters")
@@ -106,10 +237,9 @@ if (st.session_state.orders_df is not None and
         # Loan amount filter
         min_loan, max_loan = st.sidebar.slider(
             "Loan Amount Range",
-            min_value=float(st.session_state.merged_df['issued_sum'].min()),
-            max_value=float(st.session_state.merged_df['issued_sum'].max()),
-            value=(float(st.session_state.merged_df['issued_sum'].min()), 
-                   float(st.session_state.merged_df['issued_sum'].max()))
+            min_value=st.session_state.issued_lo,
+            max_value=st.session_state.issued_hi,
+            value=(st.session_state.issued_lo, st.session_state.issued_hi)
         )
         
         # Apply filters
@@ -120,13 +250,22 @@ if (st.session_state.orders_df is not None and
             (st.session_state.delinquency_df['issued_sum'] <= max_loan)
         ]
         
+        # Cache key for per-tab computations: loaded files, metrics date and active filters
+        filter_state = (
+            tuple(sorted(st.session_state.data_key.items())),
+            today, start_date, end_date, min_loan, max_loan
+        )
+        
         # Main dashboard content
         if not filtered_df.empty:
             # Dashboard metrics
             metrics_col1, metrics_col2, metrics_col3, metrics_col4 = st.columns(4)
             
+            # Worst lateness per loan gives both the loan count and the delinquent loans
+            per_order_max_late = filtered_df.groupby('order_id', observed=True, sort=False)['days_late'].max()
+            
             with metrics_col1:
-                total_loans = filtered_df['order_id'].nunique()
+                total_loans = per_order_max_late.size
                 st.metric("Total Loans", f"{total_loans:,}")
             
             with metrics_col2:
@@ -138,19 +277,27 @@ if (st.session_state.orders_df is not None and
                 st.metric("Average Payment Delay", f"{avg_delay:.1f} days")
             
             with metrics_col4:
-                delinquency_rate = (filtered_df[filtered_df['days_late'] > 0]['order_id'].nunique() / 
-                                   total_loans * 100)
+                delinquent_loans = (per_order_max_late > 0).sum()
+                delinquency_rate = delinquent_loans / total_loans * 100
                 st.metric("Delinquency Rate", f"{delinquency_rate:.1f}%")
             
-            # Visualization tabs
-            tab1, tab2, tab3, tab4 = st.tabs([
-                "Delinquency Trends", 
-                "Planned vs Actual Payments", 
-                "Payment Behavior",
-                "Summary & Export"
-            ])
+            # Visualization sections
+            # Unlike st.tabs, which runs every tab body on each rerun, only the
+            # selected section is computed and rendered
+            active_tab = st.radio(
+                "Section",
+                [
+                    "Delinquency Trends", 
+                    "Planned vs Actual Payments", 
+                    "Payment Behavior",
+                    "Summary & Export"
+                ],
+                horizontal=True,
+                label_visibility="collapsed",
+                key="active_tab"
+            )
             
-            with tab1:
+            if active_tab == "Delinquency Trends":
                 st.subheader("Delinquency Trends Analysis")
                 
                 # Delinquency trend over time
@@ -170,32 +317,9 @@ if (st.session_state.orders_df is not None and
                 
                 stats_col1, stats_col2 = st.columns(2)
                 
+                late_counts, avg_late_by_loan = _compute_tab1_stats(filtered_df, *filter_state)
+                
                 with stats_col1:
-                    # Distribution of days late
-                    # Create a function to categorize days late
-                    def categorize_days_late(days):
-                        if days <= -1:
-                            return 'Early'
-                        elif days <= 0:
-                            return 'On time'
-                        elif days <= 7:
-                            return '1-7 days'
-                        elif days <= 14:
-                            return '8-14 days'
-                        elif days <= 30:
-                            return '15-30 days'
-                        elif days <= 60:
-                            return '31-60 days'
-                        else:
-                            return '60+ days'
-                    
-                    # Apply the categorization function
-                    filtered_df_copy = filtered_df.copy()
-                    filtered_df_copy['days_late_category'] = filtered_df_copy['days_late'].apply(categorize_days_late)
-                    
-                    # Group by the category and count
-                    late_counts = filtered_df_copy.groupby('days_late_category').size().reset_index(name='count')
-                    
                     fig = px.pie(
                         late_counts, 
                         values='count', 
@@ -206,34 +330,6 @@ if (st.session_state.orders_df is not None and
                     st.plotly_chart(fig, use_container_width=True)
                 
                 with stats_col2:
-                    # Average days late by loan amount
-                    # Create loan amount ranges manually
-                    filtered_df_loan = filtered_df.copy()
-                    
-                    # Find min and max loan amounts for range creation
-                    min_loan = filtered_df_loan['issued_sum'].min()
-                    max_loan = filtered_df_loan['issued_sum'].max()
-                    
-                    # Create range bins (5 equal bins)
-                    bin_size = (max_loan - min_loan) / 5
-                    bins = [min_loan + i * bin_size for i in range(6)]
-                    
-                    # Create labels for the bins
-                    labels = [f'${bins[i]:.0f}-${bins[i+1]:.0f}' for i in range(5)]
-                    
-                    # Create a function to assign each loan to a bin
-                    def assign_loan_bin(loan_amount):
-                        for i in range(5):
-                            if bins[i] <= loan_amount < bins[i+1]:
-                                return labels[i]
-                        return labels[-1]  # For the maximum value
-                    
-                    # Apply the binning function
-                    filtered_df_loan['loan_amount_range'] = filtered_df_loan['issued_sum'].apply(assign_loan_bin)
-                    
-                    # Group by the loan amount range and calculate average days late
-                    avg_late_by_loan = filtered_df_loan.groupby('loan_amount_range')['days_late'].mean().reset_index()
-                    
                     fig = px.bar(
                         avg_late_by_loan,
                         x='loan_amount_range',
@@ -245,7 +341,7 @@ if (st.session_state.orders_df is not None and
                     )
                     st.plotly_chart(fig, use_container_width=True)
             
-            with tab2:
+            elif active_tab == "Planned vs Actual Payments":
                 st.subheader("Planned vs Actual Payments")
                 
                 # Payment comparison chart
@@ -258,48 +354,39 @@ if (st.session_state.orders_df is not None and
                 st.subheader("Payment Gap Analysis")
                 payment_col1, payment_col2 = st.columns(2)
                 
+                gap_counts, gap_edges, sample_df = _compute_tab2_stats(filtered_df, *filter_state)
+                
                 with payment_col1:
-                    # Payment gap distribution
-                    payment_gap_df = filtered_df.copy()
-                    payment_gap_df['payment_gap'] = payment_gap_df['plan_sum_total'] - payment_gap_df['paid_sum']
-                    payment_gap_df['gap_percentage'] = (payment_gap_df['payment_gap'] / 
-                                                       payment_gap_df['plan_sum_total'] * 100)
-                    
-                    fig = px.histogram(
-                        payment_gap_df,
-                        x='gap_percentage',
+                    fig = go.Figure(go.Bar(
+                        x=(gap_edges[:-1] + gap_edges[1:]) / 2,
+                        y=gap_counts,
+                        width=np.diff(gap_edges),
+                        marker_color='#E74C3C'
+                    ))
+                    fig.update_layout(
                         title='Distribution of Payment Gaps (%)',
-                        labels={'gap_percentage': 'Payment Gap (%)'},
-                        color_discrete_sequence=['#E74C3C']
+                        xaxis_title='Payment Gap (%)',
+                        yaxis_title='count',
+                        bargap=0
                     )
                     st.plotly_chart(fig, use_container_width=True)
                 
                 with payment_col2:
-                    # Cumulative payments over time
-                    payment_time_df = filtered_df.sort_values('plan_at')
-                    payment_time_df['cumulative_planned'] = payment_time_df.groupby('order_id')['plan_sum_total'].cumsum()
-                    payment_time_df['cumulative_actual'] = payment_time_df.groupby('order_id')['paid_sum'].cumsum()
-                    
-                    # Take a sample of orders for clarity
-                    sample_orders = payment_time_df['order_id'].unique()[:5]
-                    sample_df = payment_time_df[payment_time_df['order_id'].isin(sample_orders)]
-                    
                     fig = go.Figure()
                     
-                    for order_id in sample_orders:
-                        order_data = sample_df[sample_df['order_id'] == order_id]
-                        
-                        fig.add_trace(go.Scatter(
-                            x=order_data['plan_at'],
-                            y=order_data['cumulative_planned'],
+                    # Groups come out in the order the sample was drawn (earliest plan first)
+                    for order_id, order_data in sample_df.groupby('order_id', observed=True, sort=False):
+                        fig.add_trace(go.Scattergl(
+                            x=order_data['plan_at'].values,
+                            y=order_data['cumulative_planned'].values,
                             mode='lines',
                             name=f'Order {order_id} (Planned)',
                             line=dict(dash='solid')
                         ))
                         
-                        fig.add_trace(go.Scatter(
-                            x=order_data['paid_at'],
-                            y=order_data['cumulative_actual'],
+                        fig.add_trace(go.Scattergl(
+                            x=order_data['paid_at'].values,
+                            y=order_data['cumulative_actual'].values,
                             mode='lines',
                             name=f'Order {order_id} (Actual)',
                             line=dict(dash='dot')
@@ -313,7 +400,7 @@ if (st.session_state.orders_df is not None and
                     )
                     st.plotly_chart(fig, use_container_width=True)
             
-            with tab3:
+            elif active_tab == "Payment Behavior":
                 st.subheader("Payment Behavior Analysis")
                 
                 # Payment behavior chart
@@ -325,18 +412,9 @@ if (st.session_state.orders_df is not None and
                 # Additional payment behavior analytics
                 behavior_col1, behavior_col2 = st.columns(2)
                 
+                avg_lateness_by_age, monthly_delinquency = _compute_tab3_stats(filtered_df, *filter_state)
+                
                 with behavior_col1:
-                    # Payment lateness over loan duration
-                    loan_duration_df = filtered_df.copy()
-                    
-                    # Calculate loan age in days first
-                    loan_duration_df['loan_age_days'] = (loan_duration_df['plan_at'] - loan_duration_df['put_at']).dt.days
-                    
-                    # Convert days to approximate months (using 30 days as a month for simplicity)
-                    loan_duration_df['loan_age_months'] = (loan_duration_df['loan_age_days'] / 30).astype(int)
-                    
-                    avg_lateness_by_age = loan_duration_df.groupby('loan_age_months')['days_late'].mean().reset_index()
-                    
                     fig = px.line(
                         avg_lateness_by_age,
                         x='loan_age_months',
@@ -348,21 +426,6 @@ if (st.session_state.orders_df is not None and
                     st.plotly_chart(fig, use_container_width=True)
                 
                 with behavior_col2:
-                    # Seasonal patterns in payment behavior
-                    seasonal_df = filtered_df.copy()
-                    seasonal_df['month'] = seasonal_df['plan_at'].dt.month
-                    seasonal_df['month_name'] = seasonal_df['plan_at'].dt.strftime('%B')
-                    
-                    monthly_delinquency = seasonal_df.groupby('month_name')['days_late'].mean().reset_index()
-                    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                                  'July', 'August', 'September', 'October', 'November', 'December']
-                    monthly_delinquency['month_name'] = pd.Categorical(
-                        monthly_delinquency['month_name'], 
-                        categories=month_order, 
-                        ordered=True
-                    )
-                    monthly_delinquency = monthly_delinquency.sort_values('month_name')
-                    
                     fig = px.bar(
                         monthly_delinquency,
                         x='month_name',
@@ -374,7 +437,7 @@ if (st.session_state.orders_df is not None and
                     )
                     st.plotly_chart(fig, use_container_width=True)
             
-            with tab4:
+            elif active_tab == "Summary & Export":
                 st.subheader("Summary & Data Export")
                 
                 # Summary statistics
@@ -391,6 +454,12 @@ if (st.session_state.orders_df is not None and
                 payment_deficit = total_planned - total_paid
                 payment_deficit_percentage = payment_deficit / total_planned * 100
                 
+                # Most common delinquency period: histogram over the day counts,
+                # shifted so that early payments (negative days) get valid bins
+                days_late = filtered_df['days_late'].to_numpy(dtype='int64')
+                days_late_offset = days_late.min()
+                most_common_days_late = int(np.bincount(days_late - days_late_offset).argmax() + days_late_offset)
+                
                 st.markdown(f"""
                 **Payment Timeliness:**
                 - Total payments analyzed: {total_payments:,}
@@ -403,27 +472,43 @@ if (st.session_state.orders_df is not None and
                 - Payment deficit: ${payment_deficit:,.2f} ({payment_deficit_percentage:.1f}%)
                 
                 **Delinquency Patterns:**
-                - Most common delinquency period: {filtered_df['days_late'].value_counts().idxmax()} days
+                - Most common delinquency period: {most_common_days_late} days
                 - Average delinquency duration: {filtered_df['days_late'].mean():.1f} days
                 """)
                 
                 # Data inconsistencies
                 st.markdown("### Data Inconsistencies")
                 
+                # Shared order_id categories across the three source files; each file's
+                # categories are exactly its distinct order IDs (set after dropping NA rows)
+                orders_ids = st.session_state.orders_df['order_id'].cat.categories
+                payments_ids = st.session_state.payments_df['order_id'].cat.categories
+                plan_ids = st.session_state.plan_df['order_id'].cat.categories
+                all_ids = orders_ids.union(payments_ids).union(plan_ids)
+                
+                # One boolean presence mask per file over the shared codes, so the
+                # checks below are plain AND / AND NOT over small arrays
+                present_orders = np.zeros(len(all_ids), dtype=bool)
+                present_orders[all_ids.get_indexer(orders_ids)] = True
+                present_payments = np.zeros(len(all_ids), dtype=bool)
+                present_payments[all_ids.get_indexer(payments_ids)] = True
+                present_plan = np.zeros(len(all_ids), dtype=bool)
+                present_plan[all_ids.get_indexer(plan_ids)] = True
+                
                 # Check for orders with no payments
-                orders_without_payments = set(st.session_state.orders_df['order_id']) - set(st.session_state.payments_df['order_id'])
+                orders_without_payments = int((present_orders & ~present_payments).sum())
                 
                 # Check for payments without corresponding plan
-                payments_without_plan = set(st.session_state.payments_df['order_id']) - set(st.session_state.plan_df['order_id'])
+                payments_without_plan = int((present_payments & ~present_plan).sum())
                 
                 # Check for plan entries without orders
-                plan_without_orders = set(st.session_state.plan_df['order_id']) - set(st.session_state.orders_df['order_id'])
+                plan_without_orders = int((present_plan & ~present_orders).sum())
                 
                 st.markdown(f"""
                 **Identified inconsistencies:**
-                - Orders without any payment records: {len(orders_without_payments)}
-                - Payments without a corresponding payment plan: {len(payments_without_plan)}
-                - Payment plans without corresponding orders: {len(plan_without_orders)}
+                - Orders without any payment records: {orders_without_payments}
+                - Payments without a corresponding payment plan: {payments_without_plan}
+                - Payment plans without corresponding orders: {plan_without_orders}
                 """)
                 
                 # Export options
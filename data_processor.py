@@ -1,23 +1,63 @@
 import pandas as pd
 import numpy as np
-from io import StringIO
+from pandas.api.types import union_categoricals
+import streamlit as st
+from io import BytesIO
 import datetime
 
-def process_orders_data(file):
+# st.cache_data caches are shared by all sessions; keep only the most recent
+# upload sets so large frames are not held in memory indefinitely
+_CACHE_MAX_ENTRIES = 2
+
+def _read_csv(source, dtype):
+    """
+    Parse a CSV source with the PyArrow engine, typing the columns in the same pass.
+    
+    If a value cannot be cast (e.g. a malformed date or amount), the file is
+    re-read untyped and the affected columns are coerced, turning bad values
+    into NaT/NaN instead of rejecting the whole upload.
+    
+    Args:
+        source: Raw CSV bytes
+        dtype: Mapping of column name to target dtype
+    
+    Returns:
+        pandas DataFrame with typed columns
+    """
+    try:
+        return pd.read_csv(BytesIO(source), engine='pyarrow', dtype=dtype)
+    except ValueError:
+        df = pd.read_csv(BytesIO(source), engine='pyarrow', dtype={'order_id': 'string'})
+    
+    for col, col_dtype in dtype.items():
+        if col not in df.columns:
+            continue
+        if col_dtype.startswith('datetime64'):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif col_dtype == 'float64':
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_MAX_ENTRIES)
+def process_orders_data(source):
     """
     Process the orders CSV file containing loan application details.
     
     Args:
-        file: Uploaded CSV file object
+        source: Raw CSV bytes
     
     Returns:
         pandas DataFrame with processed orders data
     """
-    # Read the file content
-    content = file.read().decode('utf-8')
-    
-    # Parse CSV data
-    df = pd.read_csv(StringIO(content))
+    # Parse CSV data, converting date and numeric columns while reading
+    df = _read_csv(source, dtype={
+        'order_id': 'string',
+        'created_at': 'datetime64[ns]',
+        'put_at': 'datetime64[ns]',
+        'closed_at': 'datetime64[ns]',
+        'issued_sum': 'float64'
+    })
     
     # Ensure required columns exist
     required_columns = ['order_id', 'created_at', 'put_at', 'closed_at', 'issued_sum']
@@ -26,39 +66,31 @@ def process_orders_data(file):
     if missing_columns:
         raise ValueError(f"Missing required columns in orders file: {', '.join(missing_columns)}")
     
-    # Convert date columns to datetime
-    date_columns = ['created_at', 'put_at', 'closed_at']
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    
-    # Convert numeric columns
-    if 'issued_sum' in df.columns:
-        df['issued_sum'] = pd.to_numeric(df['issued_sum'], errors='coerce')
-    
     # Drop rows with missing order_id
     df = df.dropna(subset=['order_id'])
     
-    # Convert order_id to string to ensure consistent joining
-    df['order_id'] = df['order_id'].astype(str)
+    # Store order_id as a categorical so joins and lookups work on integer codes
+    df['order_id'] = df['order_id'].astype('category')
     
     return df
 
-def process_plan_data(file):
+@st.cache_data(show_spinner=False, max_entries=_CACHE_MAX_ENTRIES)
+def process_plan_data(source):
     """
     Process the payment plan CSV file containing planned payment schedules.
     
     Args:
-        file: Uploaded CSV file object
+        source: Raw CSV bytes
     
     Returns:
         pandas DataFrame with processed payment plan data
     """
-    # Read the file content
-    content = file.read().decode('utf-8')
-    
-    # Parse CSV data
-    df = pd.read_csv(StringIO(content))
+    # Parse CSV data, converting date and numeric columns while reading
+    df = _read_csv(source, dtype={
+        'order_id': 'string',
+        'plan_at': 'datetime64[ns]',
+        'plan_sum_total': 'float64'
+    })
     
     # Ensure required columns exist
     required_columns = ['order_id', 'plan_at', 'plan_sum_total']
@@ -67,37 +99,31 @@ def process_plan_data(file):
     if missing_columns:
         raise ValueError(f"Missing required columns in payment plan file: {', '.join(missing_columns)}")
     
-    # Convert date columns to datetime
-    if 'plan_at' in df.columns:
-        df['plan_at'] = pd.to_datetime(df['plan_at'], errors='coerce')
-    
-    # Convert numeric columns
-    if 'plan_sum_total' in df.columns:
-        df['plan_sum_total'] = pd.to_numeric(df['plan_sum_total'], errors='coerce')
-    
     # Drop rows with missing order_id or plan_at
     df = df.dropna(subset=['order_id', 'plan_at'])
     
-    # Convert order_id to string to ensure consistent joining
-    df['order_id'] = df['order_id'].astype(str)
+    # Store order_id as a categorical so joins and lookups work on integer codes
+    df['order_id'] = df['order_id'].astype('category')
     
     return df
 
-def process_payments_data(file):
+@st.cache_data(show_spinner=False, max_entries=_CACHE_MAX_ENTRIES)
+def process_payments_data(source):
     """
     Process the actual payments CSV file containing payment records.
     
     Args:
-        file: Uploaded CSV file object
+        source: Raw CSV bytes
     
     Returns:
         pandas DataFrame with processed payment data
     """
-    # Read the file content
-    content = file.read().decode('utf-8')
-    
-    # Parse CSV data
-    df = pd.read_csv(StringIO(content))
+    # Parse CSV data, converting date and numeric columns while reading
+    df = _read_csv(source, dtype={
+        'order_id': 'string',
+        'paid_at': 'datetime64[ns]',
+        'paid_sum': 'float64'
+    })
     
     # Ensure required columns exist
     required_columns = ['order_id', 'paid_at', 'paid_sum']
@@ -106,22 +132,15 @@ def process_payments_data(file):
     if missing_columns:
         raise ValueError(f"Missing required columns in payments file: {', '.join(missing_columns)}")
     
-    # Convert date columns to datetime
-    if 'paid_at' in df.columns:
-        df['paid_at'] = pd.to_datetime(df['paid_at'], errors='coerce')
-    
-    # Convert numeric columns
-    if 'paid_sum' in df.columns:
-        df['paid_sum'] = pd.to_numeric(df['paid_sum'], errors='coerce')
-    
     # Drop rows with missing order_id or paid_at
     df = df.dropna(subset=['order_id', 'paid_at'])
     
-    # Convert order_id to string to ensure consistent joining
-    df['order_id'] = df['order_id'].astype(str)
+    # Store order_id as a categorical so joins and lookups work on integer codes
+    df['order_id'] = df['order_id'].astype('category')
     
     return df
 
+@st.cache_data(show_spinner=False, max_entries=_CACHE_MAX_ENTRIES)
 def merge_data(orders_df, plan_df, payments_df):
     """
     Merge the three datasets into a single dataframe for analysis.
@@ -134,12 +153,25 @@ def merge_data(orders_df, plan_df, payments_df):
     Returns:
         Merged DataFrame with all relevant information
     """
+    # Share one set of order_id categories so the merges compare integer codes
+    categories = union_categoricals(
+        [orders_df['order_id'], plan_df['order_id'], payments_df['order_id']]
+    ).categories
+    orders_df, plan_df, payments_df = (
+        df.assign(order_id=pd.Categorical(df['order_id'], categories=categories))
+        for df in (orders_df, plan_df, payments_df)
+    )
+    
     # First merge orders with payment plan
+    # Each order must appear only once, otherwise its plan rows would be duplicated
     merged_df = pd.merge(
         orders_df,
         plan_df,
         on='order_id',
-        how='inner'
+        how='inner',
+        sort=False,
+        copy=False,
+        validate='one_to_many'
     )
     
     # Then merge with actual payments
@@ -149,6 +181,8 @@ def merge_data(orders_df, plan_df, payments_df):
         payments_df,
         on='order_id',
         how='left',
+        sort=False,
+        copy=False,
         suffixes=('', '_payment')
     )
     
@@ -166,37 +200,59 @@ def merge_data(orders_df, plan_df, payments_df):
     
     return merged_df
 
-def calculate_delinquency_metrics(merged_df):
+def _downcast(df):
+    """
+    Downcast the integer-valued metric columns of df in place.
+    
+    Day counts and flags fit in small integers, so narrower columns mean fewer
+    bytes per groupby/filter pass. to_numeric picks the smallest type that holds
+    the actual range and leaves columns with missing values untouched. Money
+    columns stay float64: pandas sums float32 columns in float32, which loses
+    cents on the dashboard totals.
+    
+    Args:
+        df: DataFrame with days_late, loan_age_days and is_delinquent columns
+    """
+    for col in ('days_late', 'loan_age_days', 'is_delinquent'):
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_MAX_ENTRIES)
+def calculate_delinquency_metrics(merged_df, today):
     """
     Calculate delinquency metrics based on the merged data.
     
+    The metric columns are added to merged_df in place rather than to a copy,
+    since the merged frame is the largest allocation in the pipeline.
+    
     Args:
         merged_df: Merged DataFrame with orders, plan, and payments data
+        today: Current date (normalized Timestamp) that unpaid installments are
+            measured against; part of the cache key so lateness keeps advancing
     
     Returns:
-        DataFrame with additional delinquency metrics
+        The same DataFrame with additional delinquency metrics
     """
-    # Make a copy to avoid modifying the original
-    df = merged_df.copy()
+    df = merged_df
     
     # Calculate days between planned and actual payment dates
     if 'plan_at' in df.columns and 'paid_at' in df.columns:
-        # For payments that have been made
-        mask = df['paid_at'].notna()
-        df.loc[mask, 'days_late'] = (df.loc[mask, 'paid_at'] - df.loc[mask, 'plan_at']).dt.days
-        
         # For payments that haven't been made, use today's date to calculate lateness
-        mask = df['paid_at'].isna()
-        today = pd.Timestamp.now().normalize()
-        df.loc[mask, 'days_late'] = (today - df.loc[mask, 'plan_at']).dt.days
+        plan_at = df['plan_at'].to_numpy()
+        paid_at = df['paid_at'].to_numpy()
+        effective_at = np.where(np.isnat(paid_at), pd.Timestamp(today).to_datetime64(), paid_at)
+        
+        # Floor division gives the same whole days as Timedelta.days, including negatives
+        df['days_late'] = (effective_at - plan_at) // np.timedelta64(1, 'D')
     else:
         df['days_late'] = 0
     
     # Calculate payment gap (difference between planned and actual payment amounts)
     if 'plan_sum_total' in df.columns and 'paid_sum' in df.columns:
         df['payment_gap'] = df['plan_sum_total'] - df['paid_sum']
+        df['payment_gap_pct'] = df['payment_gap'] / df['plan_sum_total'] * 100
     else:
         df['payment_gap'] = 0
+        df['payment_gap_pct'] = 0
     
     # Calculate delinquency flag (1 if payment is late, 0 otherwise)
     df['is_delinquent'] = (df['days_late'] > 0).astype(int)
@@ -207,7 +263,24 @@ def calculate_delinquency_metrics(merged_df):
     else:
         df['loan_age_days'] = 0
     
+    # Narrow the integer metric columns before they are aggregated
+    _downcast(df)
+    
+    # Convert days to approximate months (using 30 days as a month for simplicity),
+    # keeping loans without an issue date as missing values
+    df['loan_age_months'] = np.trunc(df['loan_age_days'] / 30).astype('Int32')
+    
+    # Month of the planned payment, ordered January to December for seasonal views
+    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
+                   'July', 'August', 'September', 'October', 'November', 'December']
+    df['month_name'] = pd.Categorical.from_codes(
+        df['plan_at'].dt.month.fillna(0).astype(int) - 1,
+        categories=month_order,
+        ordered=True
+    )
+    
     # Calculate payment category based on days late
+    # (pd.cut yields an ordered categorical, so grouping by status works on integer codes)
     df['payment_status'] = pd.cut(
         df['days_late'],
         bins=[-float('inf'), -1, 0, 7, 30, 60, float('inf')],
@@ -1,7 +1,7 @@
 import pandas as pd
 import streamlit as st
 import io
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 def format_currency(amount):
     """
@@ -25,20 +25,11 @@ def download_csv(df):
     Returns:
         CSV data as string
     """
-    # Create a copy of the dataframe
-    download_df = df.copy()
-    
-    # Convert datetime columns to string
-    for col in download_df.columns:
-        if pd.api.types.is_datetime64_any_dtype(download_df[col]):
-            download_df[col] = download_df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Convert to CSV
-    csv = download_df.to_csv(index=False)
+    # Convert to CSV, formatting datetime columns inside the writer (no copy needed)
+    csv = df.to_csv(index=False, date_format='%Y-%m-%d %H:%M:%S')
     
     return csv
 
-
 def download_excel(df):
     """
     Prepare dataframe for Excel download.
@@ -55,7 +46,7 @@ def download_excel(df):
     # Create an in-memory Excel file
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        download_df.to_excel(writer, sheet_name='Credit Loan Analysis', index=False)
+        download_df.to_excel(writer, sheet_name='Credit Loan Analysis', index=False, freeze_panes=(1, 0))
         
         # Get the worksheet
         workbook = writer.book
@@ -70,14 +61,19 @@ def download_excel(df):
             'border': 1
         })
         
+        # Two-decimal display format applied per column rather than per cell
+        float_format = workbook.add_format({'num_format': '0.00'})
+        
         # Write the column headers with the defined format
         for col_num, value in enumerate(download_df.columns.values):
             worksheet.write(0, col_num, value, header_format)
             
-        # Adjust column widths
+        # Adjust column widths, estimated from the first rows with vectorized string lengths
+        sample_df = download_df.head(1000).astype(str)
         for i, col in enumerate(download_df.columns):
-            column_width = max(len(str(col)), download_df[col].map(lambda x: len(str(x))).max())
-            worksheet.set_column(i, i, column_width + 2)
+            column_width = max(len(str(col)), int(sample_df[col].str.len().max()) if len(sample_df) else 0)
+            column_format = float_format if pd.api.types.is_float_dtype(download_df[col]) else None
+            worksheet.set_column(i, i, column_width + 2, column_format)
     
     # Reset the pointer to the beginning
     output.seek(0)
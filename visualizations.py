@@ -1,9 +1,142 @@
+import os
 import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+import plotly.io as pio
+import streamlit as st
 
+# Общее оформление графиков: горизонтальная легенда над графиком
+pio.templates['devim'] = go.layout.Template(
+    layout=go.Layout(
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+)
+
+# Положение заголовка задается на уровне фигуры: тема Streamlit перекрывает
+# настройки заголовка из шаблона и выравнивает его по левому краю
+TITLE_POSITION = dict(
+    y=0.95,
+    x=0.5,
+    xanchor='center',
+    yanchor='top'
+)
+
+# Шаблон по умолчанию (в Streamlit — шаблон его темы), дополненный общим оформлением
+CHART_TEMPLATE = f"{pio.templates.default}+devim"
+
+# Polars — необязательная зависимость для агрегаций на больших выборках
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Агрегации через Polars включаются переменной окружения USE_POLARS=1
+USE_POLARS = pl is not None and os.environ.get('USE_POLARS', '').lower() in ('1', 'true', 'yes')
+
+# Русские подписи статусов платежей
+STATUS_LABELS_RU = {
+    'Early': 'Досрочно',
+    'On Time': 'Вовремя',
+    'Slightly Late (1-7 days)': 'Немного просрочено (1-7 дней)',
+    'Late (8-30 days)': 'Просрочено (8-30 дней)',
+    'Very Late (31-60 days)': 'Сильно просрочено (31-60 дней)',
+    'Extremely Late (60+ days)': 'Критически просрочено (60+ дней)'
+}
+
+def _frame_fingerprint(df):
+    """
+    Вычисляет дешевый отпечаток датафрейма для ключа кэша графиков.
+    
+    Args:
+        df: DataFrame с отфильтрованными данными
+    
+    Returns:
+        Кортеж из числа строк, набора столбцов, границ дат плана и сумм числовых столбцов
+    """
+    return (
+        len(df),
+        tuple(df.columns),
+        str(df['plan_at'].min()),
+        str(df['plan_at'].max()),
+        tuple(df.select_dtypes('number').sum().round(6).tolist())
+    )
+
+# Кэширование графиков между перезапусками страницы Streamlit;
+# возвращаемые фигуры не должны изменяться вызывающим кодом
+_cache_chart = st.cache_data(
+    show_spinner=False,
+    max_entries=16,
+    hash_funcs={pd.DataFrame: _frame_fingerprint}
+)
+
+def _month_key(plan_at):
+    """
+    Вычисляет целочисленный ключ месяца (ГГГГММ) для каждой даты плана.
+    
+    Args:
+        plan_at: Series с датами плана платежей
+    
+    Returns:
+        Массив int32 с ключами вида year * 100 + month
+    """
+    return (plan_at.dt.year.to_numpy() * 100 + plan_at.dt.month.to_numpy()).astype(np.int32)
+
+def _monthly_counts(df, group_col):
+    """
+    Считает количество строк по месяцу плана и значениям категориального столбца.
+    
+    Args:
+        df: DataFrame с датами плана и категориальным столбцом
+        group_col: Имя категориального столбца для разбиения
+    
+    Returns:
+        DataFrame с ключами месяцев ГГГГММ в индексе и значениями group_col в столбцах
+    """
+    if not USE_POLARS:
+        return pd.crosstab(
+            index=_month_key(df['plan_at']),
+            columns=df[group_col],
+            rownames=['month']
+        )
+    
+    # Многопоточная агрегация в Polars; обратно в pandas переносится только маленький результат
+    long_counts = (
+        pl.from_pandas(df.loc[:, ['plan_at', group_col]])
+        .drop_nulls(group_col)
+        .group_by(
+            (pl.col('plan_at').dt.year() * 100 + pl.col('plan_at').dt.month()).cast(pl.Int32).alias('month'),
+            pl.col(group_col).cast(pl.String)
+        )
+        .agg(pl.len().alias('count'))
+        .to_pandas()
+    )
+    counts = long_counts.pivot(index='month', columns=group_col, values='count').fillna(0).astype(np.int64)
+    
+    # Порядок столбцов как у категорий pandas (только встречающиеся значения)
+    categories = [c for c in df[group_col].cat.categories if c in counts.columns]
+    return counts.sort_index().reindex(columns=categories)
+
+def _month_labels(month_key):
+    """
+    Преобразует ключи месяцев ГГГГММ в подписи вида 'ГГГГ-ММ'.
+    
+    Args:
+        month_key: Последовательность ключей месяцев (уже агрегированных)
+    
+    Returns:
+        Index со строковыми подписями месяцев
+    """
+    return pd.to_datetime(pd.Index(month_key).astype(str), format='%Y%m').strftime('%Y-%m')
+
+@_cache_chart
 def create_delinquency_trend_chart(df):
     """
     Создает график, показывающий тренды просрочек платежей во времени.
@@ -14,17 +147,16 @@ def create_delinquency_trend_chart(df):
     Returns:
         Объект графика Plotly
     """
-    # Группировка по дате плана и расчет средней просрочки в днях
-    trend_df = df.groupby(df['plan_at'].dt.to_period('M').astype(str)).agg({
-        'days_late': 'mean',
-        'is_delinquent': 'mean',
-        'order_id': 'count'
-    }).reset_index()
-    
-    trend_df.rename(columns={
-        'is_delinquent': 'delinquency_rate',
-        'order_id': 'payment_count'
-    }, inplace=True)
+    # Группировка по месяцу плана: все три показателя за один проход по группам
+    trend_df = df.groupby(_month_key(df['plan_at']), sort=True).agg(
+        days_late=('days_late', 'mean'),
+        delinquency_rate=('is_delinquent', 'mean'),
+        payment_count=('order_id', 'count')
+    )
+    
+    # Подписи месяцев формируются только для агрегированных строк
+    trend_df.index = pd.Index(_month_labels(trend_df.index), name='plan_at')
+    trend_df = trend_df.reset_index()
     
     trend_df['delinquency_rate'] = trend_df['delinquency_rate'] * 100
     
@@ -40,8 +172,8 @@ def create_delinquency_trend_chart(df):
     # Добавление столбчатой диаграммы для средней просрочки в днях
     fig.add_trace(
         go.Bar(
-            x=trend_df['plan_at'],
-            y=trend_df['days_late'],
+            x=trend_df['plan_at'].to_numpy(),
+            y=trend_df['days_late'].to_numpy(),
             name='Средняя просрочка (дни)',
             marker_color='#E74C3C'
         ),
@@ -50,9 +182,9 @@ def create_delinquency_trend_chart(df):
     
     # Добавление линейного графика для процента просроченных платежей
     fig.add_trace(
-        go.Scatter(
-            x=trend_df['plan_at'],
-            y=trend_df['delinquency_rate'],
+        go.Scattergl(
+            x=trend_df['plan_at'].to_numpy(),
+            y=trend_df['delinquency_rate'].to_numpy(),
             name='Процент просрочек (%)',
             mode='lines+markers',
             line=dict(color='#2C3E50', width=2),
@@ -63,25 +195,13 @@ def create_delinquency_trend_chart(df):
     
     # Обновление макета
     fig.update_layout(
+        template=CHART_TEMPLATE,
         height=600,
         showlegend=True,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
         xaxis2_title="Месяц",
         yaxis_title="Средняя просрочка (дни)",
         yaxis2_title="Процент просрочек (%)",
-        title={
-            'text': "Анализ тенденций просрочек платежей",
-            'y':0.95,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'
-        },
+        title=dict(TITLE_POSITION, text="Анализ тенденций просрочек платежей"),
         annotations=[
             dict(
                 text="<i>График показывает динамику просрочек платежей во времени. Верхняя часть отображает среднее количество дней просрочки по месяцам, нижняя - процент платежей с просрочкой. Данные агрегированы по месяцам на основе запланированной даты платежа.</i>",
@@ -99,6 +219,7 @@ def create_delinquency_trend_chart(df):
     
     return fig
 
+@_cache_chart
 def create_payment_comparison_chart(df):
     """
     Создает график, сравнивающий запланированные и фактические платежи.
@@ -109,11 +230,15 @@ def create_payment_comparison_chart(df):
     Returns:
         Объект графика Plotly
     """
-    # Группировка по дате плана и агрегация сумм платежей
-    payment_comp_df = df.groupby(df['plan_at'].dt.to_period('M').astype(str)).agg({
-        'plan_sum_total': 'sum',
-        'paid_sum': 'sum'
-    }).reset_index()
+    # Группировка по месяцу плана и агрегация сумм платежей
+    payment_comp_df = df.groupby(_month_key(df['plan_at']), sort=True).agg(
+        plan_sum_total=('plan_sum_total', 'sum'),
+        paid_sum=('paid_sum', 'sum')
+    )
+    
+    # Подписи месяцев формируются только для агрегированных строк
+    payment_comp_df.index = pd.Index(_month_labels(payment_comp_df.index), name='plan_at')
+    payment_comp_df = payment_comp_df.reset_index()
     
     # Расчет процента запланированных платежей, которые были фактически оплачены
     payment_comp_df['payment_rate'] = payment_comp_df['paid_sum'] / payment_comp_df['plan_sum_total'] * 100
@@ -130,8 +255,8 @@ def create_payment_comparison_chart(df):
     # Добавление столбчатой диаграммы для запланированных и фактических сумм платежей
     fig.add_trace(
         go.Bar(
-            x=payment_comp_df['plan_at'],
-            y=payment_comp_df['plan_sum_total'],
+            x=payment_comp_df['plan_at'].to_numpy(),
+            y=payment_comp_df['plan_sum_total'].to_numpy(),
             name='Запланированные платежи',
             marker_color='#2C3E50'
         ),
@@ -140,8 +265,8 @@ def create_payment_comparison_chart(df):
     
     fig.add_trace(
         go.Bar(
-            x=payment_comp_df['plan_at'],
-            y=payment_comp_df['paid_sum'],
+            x=payment_comp_df['plan_at'].to_numpy(),
+            y=payment_comp_df['paid_sum'].to_numpy(),
             name='Фактические платежи',
             marker_color='#27AE60'
         ),
@@ -150,9 +275,9 @@ def create_payment_comparison_chart(df):
     
     # Добавление линейного графика для процента выполнения платежей
     fig.add_trace(
-        go.Scatter(
-            x=payment_comp_df['plan_at'],
-            y=payment_comp_df['payment_rate'],
+        go.Scattergl(
+            x=payment_comp_df['plan_at'].to_numpy(),
+            y=payment_comp_df['payment_rate'].to_numpy(),
             name='Процент выполнения (%)',
             mode='lines+markers',
             line=dict(color='#E74C3C', width=2),
@@ -161,40 +286,16 @@ def create_payment_comparison_chart(df):
         row=2, col=1
     )
     
-    # Добавление референсной линии 100%
-    fig.add_trace(
-        go.Scatter(
-            x=payment_comp_df['plan_at'],
-            y=[100] * len(payment_comp_df),
-            name='Целевые 100%',
-            mode='lines',
-            line=dict(color='rgba(0,0,0,0.3)', width=1, dash='dash')
-        ),
-        row=2, col=1
-    )
-    
     # Обновление макета
     fig.update_layout(
+        template=CHART_TEMPLATE,
         height=600,
         showlegend=True,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
         xaxis2_title="Месяц",
         yaxis_title="Сумма платежей",
         yaxis2_title="Процент выполнения (%)",
         barmode='group',
-        title={
-            'text': "Сравнение запланированных и фактических платежей",
-            'y':0.95,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'
-        },
+        title=dict(TITLE_POSITION, text="Сравнение запланированных и фактических платежей"),
         annotations=[
             dict(
                 text="<i>График сравнивает запланированные и фактические суммы платежей по месяцам. Верхняя часть показывает абсолютные суммы, нижняя - процент выполнения платежей (отношение фактически оплаченной суммы к запланированной). Пунктирная линия обозначает целевой уровень 100%.</i>",
@@ -208,8 +309,18 @@ def create_payment_comparison_chart(df):
         ]
     )
     
+    # Добавление референсной линии 100% (после update_layout, чтобы не потерять ее подпись)
+    fig.add_hline(
+        y=100,
+        line=dict(color='rgba(0,0,0,0.3)', width=1, dash='dash'),
+        annotation_text='Целевые 100%',
+        annotation_position='top right',
+        row=2, col=1
+    )
+    
     return fig
 
+@_cache_chart
 def create_payment_behavior_chart(df):
     """
     Создает график, показывающий модели поведения плательщиков.
@@ -220,28 +331,14 @@ def create_payment_behavior_chart(df):
     Returns:
         Объект графика Plotly
     """
-    # Расчет распределения статусов платежей по месяцам
-    behavior_df = df.copy()
-    behavior_df['month'] = behavior_df['plan_at'].dt.to_period('M').astype(str)
-    
-    # Сводная таблица для получения количества платежей по статусам и месяцам
-    behavior_pivot = pd.pivot_table(
-        behavior_df,
-        values='order_id',
-        index='month',
-        columns='payment_status',
-        aggfunc='count',
-        fill_value=0,
-        observed=True  # Добавлено observed=True для устранения FutureWarning
-    ).reset_index()
+    # Количество платежей по статусам и месяцам
+    counts = _monthly_counts(df, 'payment_status')
     
-    # Расчет общего количества платежей в месяц для процентного расчета
-    behavior_pivot['total'] = behavior_pivot.iloc[:, 1:].sum(axis=1)
+    # Подписи месяцев формируются только для агрегированных строк
+    months = _month_labels(counts.index)
     
-    # Преобразование в проценты
-    for col in behavior_pivot.columns:
-        if col not in ['month', 'total']:
-            behavior_pivot[f'{col}_pct'] = behavior_pivot[col] / behavior_pivot['total'] * 100
+    # Преобразование в проценты от общего количества платежей в месяц
+    pct = counts.div(counts.sum(axis=1), axis=0).mul(100)
     
     # Создание графика
     fig = make_subplots(
@@ -268,87 +365,42 @@ def create_payment_behavior_chart(df):
         'Критически просрочено (60+ дней)': '#E74C3C'
     }
     
-    # Добавление столбчатой диаграммы для количества
-    for status in behavior_pivot.columns:
-        if status not in ['month', 'total'] and not status.endswith('_pct'):
-            # Перевод статусов на русский язык для отображения
-            status_ru = status
-            if status == 'Early':
-                status_ru = 'Досрочно'
-            elif status == 'On Time':
-                status_ru = 'Вовремя'
-            elif status == 'Slightly Late (1-7 days)':
-                status_ru = 'Немного просрочено (1-7 дней)'
-            elif status == 'Late (8-30 days)':
-                status_ru = 'Просрочено (8-30 дней)'
-            elif status == 'Very Late (31-60 days)':
-                status_ru = 'Сильно просрочено (31-60 дней)'
-            elif status == 'Extremely Late (60+ days)':
-                status_ru = 'Критически просрочено (60+ дней)'
-                
-            fig.add_trace(
-                go.Bar(
-                    x=behavior_pivot['month'],
-                    y=behavior_pivot[status],
-                    name=status_ru,
-                    marker_color=status_colors.get(status, '#000000')
-                ),
-                row=1, col=1
-            )
-    
-    # Добавление столбчатой диаграммы для процентов
-    for status in behavior_pivot.columns:
-        if status.endswith('_pct'):
-            status_name = status.replace('_pct', '')
-            if status_name not in ['month', 'total']:
-                # Перевод статусов на русский язык для отображения
-                status_ru = status_name
-                if status_name == 'Early':
-                    status_ru = 'Досрочно'
-                elif status_name == 'On Time':
-                    status_ru = 'Вовремя'
-                elif status_name == 'Slightly Late (1-7 days)':
-                    status_ru = 'Немного просрочено (1-7 дней)'
-                elif status_name == 'Late (8-30 days)':
-                    status_ru = 'Просрочено (8-30 дней)'
-                elif status_name == 'Very Late (31-60 days)':
-                    status_ru = 'Сильно просрочено (31-60 дней)'
-                elif status_name == 'Extremely Late (60+ days)':
-                    status_ru = 'Критически просрочено (60+ дней)'
-                
-                fig.add_trace(
-                    go.Bar(
-                        x=behavior_pivot['month'],
-                        y=behavior_pivot[status],
-                        name=f"{status_ru} (%)",
-                        marker_color=status_colors.get(status_name, '#000000'),
-                        showlegend=False
-                    ),
-                    row=2, col=1
-                )
+    # Добавление столбчатых диаграмм для количества и процентов
+    for status in counts.columns:
+        # Перевод статусов на русский язык для отображения
+        status_ru = STATUS_LABELS_RU.get(status, status)
+        
+        fig.add_trace(
+            go.Bar(
+                x=months,
+                y=counts[status].to_numpy(),
+                name=status_ru,
+                marker_color=status_colors.get(status, '#000000')
+            ),
+            row=1, col=1
+        )
+        
+        fig.add_trace(
+            go.Bar(
+                x=months,
+                y=pct[status].to_numpy(),
+                name=f"{status_ru} (%)",
+                marker_color=status_colors.get(status, '#000000'),
+                showlegend=False
+            ),
+            row=2, col=1
+        )
     
     # Обновление макета
     fig.update_layout(
+        template=CHART_TEMPLATE,
         height=700,
         showlegend=True,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
         xaxis2_title="Месяц",
         yaxis_title="Количество платежей",
         yaxis2_title="Процент (%)",
         barmode='stack',
-        title={
-            'text': "Анализ поведения плательщиков",
-            'y':0.95,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'
-        },
+        title=dict(TITLE_POSITION, text="Анализ поведения плательщиков"),
         annotations=[
             dict(
                 text="<i>График показывает распределение платежей по статусам своевременности. Верхняя часть отображает абсолютное количество платежей каждого статуса по месяцам, нижняя - процентное соотношение. Статусы варьируются от досрочных платежей до критически просроченных (более 60 дней).</i>",
@@ -364,6 +416,7 @@ def create_payment_behavior_chart(df):
     
     return fig
 
+@_cache_chart
 def create_delinquency_heatmap(df):
     """
     Создает тепловую карту, показывающую закономерности просрочек.
@@ -374,41 +427,29 @@ def create_delinquency_heatmap(df):
     Returns:
         Объект графика Plotly
     """
-    # Создание копии датафрейма
-    heatmap_df = df.copy()
-    
-    # Извлечение месяца и года из даты плана
-    heatmap_df['month'] = heatmap_df['plan_at'].dt.month
-    heatmap_df['year'] = heatmap_df['plan_at'].dt.year
+    # Извлечение месяца и года из даты плана (отдельные Series вместо копии датафрейма)
+    month = df['plan_at'].dt.month.rename('month')
+    year = df['plan_at'].dt.year.rename('year')
     
     # Группировка по месяцу и диапазону суммы займа
-    # Создание диапазонов сумм займа вручную вместо использования pd.cut
-    # Определение границ и меток диапазонов
-    bin_edges = [0, 1000, 2000, 5000, 10000, float('inf')]
+    # Определение внутренних границ и меток диапазонов
+    bin_edges = np.array([1000, 2000, 5000, 10000])
     bin_labels = ['0-1 тыс.', '1-2 тыс.', '2-5 тыс.', '5-10 тыс.', '10+ тыс.']
     
-    # Функция для присвоения каждому займу соответствующего диапазона
-    def get_loan_range(loan_amount):
-        for i in range(len(bin_edges) - 1):
-            if bin_edges[i] <= loan_amount < bin_edges[i + 1]:
-                return bin_labels[i]
-        return bin_labels[-1]  # Для максимального значения
-    
-    # Применение функции для создания диапазонов сумм займа
-    heatmap_df['loan_amount_range'] = heatmap_df['issued_sum'].apply(get_loan_range)
-
-    heatmap_df['loan_amount_range'] = pd.Categorical(
-    heatmap_df['loan_amount_range'],
-    categories=['0-1 тыс.', '1-2 тыс.', '2-5 тыс.', '5-10 тыс.', '10+ тыс.'],
-    ordered=True
+    # Номер диапазона для каждого займа одним двоичным поиском по границам
+    range_codes = np.searchsorted(bin_edges, df['issued_sum'].to_numpy(), side='right')
+    loan_amount_range = pd.Series(
+        pd.Categorical.from_codes(range_codes, categories=bin_labels, ordered=True),
+        index=df.index,
+        name='loan_amount_range'
     )
     
     # Создание сводной таблицы для тепловой карты
     heatmap_pivot = pd.pivot_table(
-        heatmap_df,
+        df,
         values='days_late',
-        index='loan_amount_range',
-        columns=['year', 'month'],
+        index=loan_amount_range,
+        columns=[year, month],
         aggfunc='mean',
         fill_value=100,
         observed=True  # Добавлено observed=True для устранения FutureWarning
@@ -417,45 +458,30 @@ def create_delinquency_heatmap(df):
     # Преобразование мульти-индекса столбцов
     heatmap_pivot.columns = [f"{year}-{month:02d}" for year, month in heatmap_pivot.columns]
     
-    # Сброс индекса для подготовки к построению графика
-    heatmap_pivot = heatmap_pivot.reset_index()
-    
-    # Преобразование датафрейма для построения тепловой карты
-    heatmap_melted = pd.melt(
-        heatmap_pivot,
-        id_vars='loan_amount_range',
-        var_name='period',
-        value_name='avg_days_late'
-    )
-    
-    # Создание тепловой карты
-    fig = px.density_heatmap(
-        heatmap_melted,
-        x='period',
-        y='loan_amount_range',
-        z='avg_days_late',
-        title='Средняя просрочка платежей по сумме займа и месяцу',
-        labels={
-            'period': 'Период',
-            'loan_amount_range': 'Диапазон суммы займа',
-            'avg_days_late': 'Средняя просрочка (дни)'
-        },
-        color_continuous_scale=px.colors.sequential.Reds
+    # Создание тепловой карты напрямую из сводной таблицы (без melt и повторной агрегации)
+    fig = go.Figure(
+        go.Heatmap(
+            z=heatmap_pivot.to_numpy(),
+            x=list(heatmap_pivot.columns),
+            y=heatmap_pivot.index.astype(str).tolist(),
+            coloraxis='coloraxis',
+            hovertemplate=(
+                'Период=%{x}<br>'
+                'Диапазон суммы займа=%{y}<br>'
+                'Средняя просрочка (дни)=%{z}<extra></extra>'
+            )
+        )
     )
+    fig.update_layout(coloraxis=dict(colorscale=px.colors.sequential.Reds))
     
     # Обновление макета
     fig.update_layout(
+        template=CHART_TEMPLATE,
         height=500,
         xaxis_title="Период (Год-Месяц)",
         yaxis_title="Диапазон суммы займа",
         coloraxis_colorbar=dict(title="Средняя просрочка (дни)"),
-        title={
-            'text': "Тепловая карта просрочек по сумме займа",
-            'y':0.95,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'
-        },
+        title=dict(TITLE_POSITION, text="Тепловая карта просрочек по сумме займа"),
         annotations=[
             dict(
                 text="<i>Тепловая карта показывает среднюю продолжительность просрочки (в днях) в зависимости от суммы займа и периода. Более темные цвета соответствуют более длительным просрочкам. Данные агрегированы по месяцам и диапазонам сумм займов.</i>",